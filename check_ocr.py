@@ -1,97 +1,608 @@
 import sys
 import os
 import subprocess
+import multiprocessing
+import queue
+from collections import deque
+import hashlib
+import json
+import logging
+import mmap
+from contextlib import contextmanager
+from functools import partial
 import pypdf
 from tqdm import tqdm
 
+try:
+    import pypdfium2 as pdfium  # Optional, much faster text extraction than pypdf
+    import pypdfium2.raw as pdfium_c
+except ImportError:
+    pdfium = None
+
 THRESHOLD = 52  # Character count threshold to determine if OCR is needed
+# While the analysis pool is busy, ocrmypdf runs alongside it, so the CPUs are split
+# between them to keep (analysis workers) + (ocrmypdf --jobs) close to the CPU count.
+# Runs started while nothing is being analyzed get every CPU.
+CPU_COUNT = os.cpu_count() or 4
+ANALYSIS_WORKERS = max(1, CPU_COUNT // 2)
+OCR_JOBS = max(1, CPU_COUNT - ANALYSIS_WORKERS)
+OCR_POLL_INTERVAL = 0.5  # Seconds between checks for a finished ocrmypdf run while analyzing
+FAST_OUTPUT = False  # Set to True to skip the single-threaded Ghostscript PDF/A conversion and optimization
+VERBOSE = "--verbose" in sys.argv  # Print the character count of every page
+CACHE_FILENAME = ".cache.jsonl"  # Analysis results keyed by PDF content hash, kept in the output folder
+ANALYSIS_VERSION = 1  # Bump when the page heuristics change, so cached results are discarded
+HASH_CHUNK_SIZE = 1 << 20
+MIN_CHUNK_PAGES = 20  # Smallest page range worth re-parsing the PDF for in a worker
+
+class EarlyStop(Exception):
+    """Raised from the text visitor once a page has more than THRESHOLD characters."""
 
-def analyze_pdf_pages(file_path):
+def is_not_early_stop(record):
     """
-    Analyzes a PDF file to identify pages with and without a text layer.
+    Filters out the warnings pypdf logs for an EarlyStop raised inside a form XObject.
+    pypdf extracts each form inside a try/except that logs any exception as
+    "Impossible to decode XFormObject". Only that form is cut short, and the next
+    text outside it raises again, so these warnings are not real decoding errors.
 
     Args:
-        file_path (str): The path to the PDF file.
-    
+        record (logging.LogRecord): The record to check.
+
+    Returns:
+        bool: False for a warning about an EarlyStop.
+    """
+    args = record.args
+    return not (isinstance(args, dict) and isinstance(args.get("exception"), EarlyStop))
+
+logging.getLogger("pypdf._page").addFilter(is_not_early_stop)
+
+def page_has_fonts(page):
+    """
+    Checks whether a page references any fonts, i.e. whether it can carry a text layer.
+    Form XObjects have their own resources, so a page that uses them is assumed to have fonts.
+
+    Args:
+        page (pypdf.PageObject): The page to inspect.
+
+    Returns:
+        bool: False if the page cannot contain extractable text.
+    """
+    resources = page["/Resources"] if "/Resources" in page else {}
+    if resources.get("/Font"):
+        return True
+    xobjects = resources["/XObject"] if "/XObject" in resources else {}
+    return any(xobjects[name].get("/Subtype") == "/Form" for name in xobjects)
+
+def page_has_images(page):
+    """
+    Checks whether a page may draw an image, i.e. whether OCR can find anything on it.
+    Form XObjects may contain images, and inline images live in the content stream,
+    so both count as images.
+
+    Args:
+        page (pypdf.PageObject): The page to inspect.
+
+    Returns:
+        bool: False if the page is certainly blank apart from its text layer.
+    """
+    resources = page["/Resources"] if "/Resources" in page else {}
+    xobjects = resources["/XObject"] if "/XObject" in resources else {}
+    if any(xobjects[name].get("/Subtype") in ("/Image", "/Form") for name in xobjects):
+        return True
+    contents = page.get_contents()
+    return contents is not None and b"BI" in contents.get_data()
+
+def count_visible_chars(text, limit):
+    """
+    Counts the characters of a text that are not whitespace, up to a limit.
+    str.split() drops the same Unicode whitespace as str.strip() (including form
+    feeds and no-break spaces). Splitting a whole page creates a string per word,
+    so only a short head of the text is split unless it falls short of the limit.
+
+    Args:
+        text (str): The extracted text.
+        limit (int): The count at which to stop.
+
     Returns:
-        list: A list of page numbers that likely need OCR.
-    """        
+        int: The number of non-whitespace characters, capped at limit.
+    """
+    # Whitespace is counted per character, so the head and the rest can be split apart
+    head = 2 * limit
+    count = sum(map(len, text[:head].split()))
+    if count < limit and len(text) > head:
+        count += sum(map(len, text[head:].split()))
+    return min(count, limit)
+
+def count_page_chars(page):
+    """
+    Counts the characters in a page's text layer, stopping once THRESHOLD is exceeded.
+
+    Args:
+        page (pypdf.PageObject): The page to inspect.
+
+    Returns:
+        int: The character count, capped at THRESHOLD + 1.
+    """
+    count = [0]
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        count[0] += count_visible_chars(text, THRESHOLD + 1 - count[0])
+        if count[0] > THRESHOLD:
+            # Inside a form XObject, pypdf catches and logs this (see is_not_early_stop)
+            raise EarlyStop
+
     try:
-        pdf_reader = pypdf.PdfReader(file_path)
-    except FileNotFoundError:
-        print(f"Error: The file '{file_path}' was not found.")
-        return []
-    except Exception as e:
-        print(f"An error occurred while reading the PDF: {e}")
-        return []
+        page.extract_text(visitor_text=visitor)
+    except EarlyStop:
+        pass
+    return min(count[0], THRESHOLD + 1)
+
+def pypdf_page_chars(pdf_reader, start, end):
+    """
+    Counts the text layer characters of a range of pages with pypdf.
+
+    Args:
+        pdf_reader (pypdf.PdfReader): The opened PDF.
+        start (int): The 0-based index of the first page to check.
+        end (int): The 0-based index one past the last page to check.
+
+    Yields:
+        tuple: The 1-based page number, its character count, whether it has fonts and
+            whether it has images (only checked on pages with too little text).
+    """
+    for i, page in enumerate(pdf_reader.pages[start:end], start):
+        # Pages without fonts are pure images, so skip the content stream parser entirely.
+        if not page_has_fonts(page):
+            yield i + 1, 0, False, page_has_images(page)
+            continue
+        # Counting stops as soon as the page is known to have enough text.
+        num_chars = count_page_chars(page)
+        yield i + 1, num_chars, True, num_chars > THRESHOLD or page_has_images(page)
+
+def pdfium_page_chars(pdf, file_path, start, end):
+    """
+    Counts the text layer characters of a range of pages with pypdfium2.
+    If PDFium fails on a page, that page and the rest of the range are read with pypdf.
 
-    num_pages = len(pdf_reader.pages)
-    print(f"Analyzing '{file_path}' ({num_pages} pages)...")
+    Args:
+        pdf (pypdfium2.PdfDocument): The opened PDF.
+        file_path (str): The path to the PDF file, for the pypdf fallback.
+        start (int): The 0-based index of the first page to check.
+        end (int): The 0-based index one past the last page to check.
+
+    Yields:
+        tuple: The 1-based page number, its character count, whether it has fonts and
+            whether it has images (only checked on pages with too little text).
+    """
+    for i in range(start, end):
+        try:
+            page = pdf[i]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    num_chars = count_visible_chars(textpage.get_text_range(), THRESHOLD + 1)
+                    # Image objects include inline images and images nested in form XObjects
+                    has_images = num_chars > THRESHOLD or any(
+                        page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,))
+                    )
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+        except pdfium.PdfiumError as e:
+            print(f"pypdfium2 failed on page {i + 1} of '{file_path}', falling back to pypdf: {e}")
+            with map_file(file_path) as pdf_map:
+                yield from pypdf_page_chars(pypdf.PdfReader(pdf_map), i, end)
+            return
+        yield i + 1, num_chars, True, has_images
 
+@contextmanager
+def open_pdf(file_path):
+    """
+    Opens a PDF file once for page counting and analysis.
+    pypdfium2 is used when installed, as it is much faster than pypdf; pypdf is the fallback.
+
+    Args:
+        file_path (str): The path to the PDF file.
+
+    Yields:
+        tuple: The number of pages, and a function taking a 0-based (start, end)
+            page range and returning its page_chars iterator.
+    """
+    if pdfium is not None:
+        try:
+            pdf = pdfium.PdfDocument(file_path)
+        except pdfium.PdfiumError as e:
+            print(f"pypdfium2 could not read '{file_path}', falling back to pypdf: {e}")
+        else:
+            try:
+                yield len(pdf), partial(pdfium_page_chars, pdf, file_path)
+            finally:
+                pdf.close()
+            return
+
+    # pypdf reads straight from the page cache, without a private copy of the file
+    with map_file(file_path) as pdf_map:
+        pdf_reader = pypdf.PdfReader(pdf_map)
+        yield len(pdf_reader.pages), partial(pypdf_page_chars, pdf_reader)
+
+def analyze_page_range(page_chars, num_pages, verbose=VERBOSE):
+    """
+    Decides which pages of a range need OCR from their character counts.
+
+    Args:
+        page_chars (iterable): (page number, character count, has fonts, has images) tuples.
+        num_pages (int): The number of pages in the range, for the progress bar.
+        verbose (bool): Whether to record the character count of every page.
+
+    Returns:
+        tuple: The list of page numbers that likely need OCR, and the list of
+            page_chars tuples (None unless verbose), formatted by report_analysis.
+    """
     pages_needing_ocr = []
-    char_counts= []
-
-    # Use tqdm for a progress bar
-    for i in tqdm(range(num_pages), desc="Checking pages"):
-        page = pdf_reader.pages[i]
-        # Extract text. If the result is empty or only whitespace, it needs OCR.
-        text = page.extract_text().strip()
-        
+    char_counts = [] if verbose else None
+
+    # Use tqdm for a progress bar. Redraws are throttled, and worker processes
+    # leave progress reporting to the single bar in the parent.
+    progress = tqdm(
+        page_chars,
+        total=num_pages,
+        desc="Checking pages",
+        mininterval=0.5,
+        miniters=max(1, num_pages // 100),
+        smoothing=0,
+        disable=multiprocessing.current_process().name != 'MainProcess',
+    )
+    for page_info in progress:
+        page_number, num_chars, _, has_images = page_info
         # A simple heuristic: if the extracted text is very short,
         # it's likely a scanned page with no searchable text.
         # The threshold of 32 characters is a good starting point but can be adjusted.
-        char_counts.append(f"Page {i + 1}: {len(text)}")
-        if len(text) <= THRESHOLD:
-            pages_needing_ocr.append(i + 1) # Page numbers are 1-based
+        # Blank pages (separators, chapter dividers) have nothing to OCR.
+        if verbose:
+            char_counts.append(page_info) # Formatted only when reported
+        if num_chars <= THRESHOLD and has_images:
+            pages_needing_ocr.append(page_number) # Page numbers are 1-based
+
+    return pages_needing_ocr, char_counts
 
+def report_analysis(pages_needing_ocr, char_counts):
+    """
+    Prints the result of a PDF analysis.
+
+    Args:
+        pages_needing_ocr (list): The page numbers that likely need OCR.
+        char_counts (list): The per-page page_chars tuples, or None to omit them.
+    """
     print("\n--- Analysis Complete ---")
-    print("Character counts per page:")
-    for count in char_counts:
-        print(count)
+    if char_counts is not None:
+        print("Character counts per page:")
+        sys.stdout.write("".join(
+            f"Page {page_number}: {num_chars}"
+            f"{'' if has_fonts else ' (no fonts)'}{'' if has_images else ' (blank, skipped)'}\n"
+            for page_number, num_chars, has_fonts, has_images in char_counts
+        ))
     if pages_needing_ocr:
         print(f"Found {len(pages_needing_ocr)} pages that likely need OCR.")
     else:
         print("Found no pages that need OCR. The document appears to be fully searchable.")
     print("-------------------------")
-    
-    return pages_needing_ocr
 
-def run_ocr_for_file(input_file, output_folder, pages_to_ocr):
+def to_ranges(pages):
     """
-    Runs ocrmypdf on a file for the specified pages.
+    Compresses page numbers into the range syntax accepted by ocrmypdf --pages.
+
+    Args:
+        pages (list): A list of page numbers, e.g. [1, 2, 3, 5].
+
+    Returns:
+        str: The pages as comma-separated ranges, e.g. "1-3,5".
+    """
+    pages = sorted(set(pages))
+    ranges = []
+    i = 0
+    while i < len(pages):
+        j = i
+        while j + 1 < len(pages) and pages[j + 1] == pages[j] + 1:
+            j += 1
+        ranges.append(f"{pages[i]}" if i == j else f"{pages[i]}-{pages[j]}")
+        i = j + 1
+    return ",".join(ranges)
+
+def start_ocr_for_file(input_file, output_folder, pages_to_ocr, jobs=CPU_COUNT):
+    """
+    Starts ocrmypdf in the background on a file for the specified pages.
 
     Args:
         input_file (str): The path to the input PDF file.
         output_folder (str): The folder to save the OCR'd file.
-        pages_to_ocr (list): A list of page numbers to perform OCR on.
+        pages_to_ocr (list): A non-empty list of page numbers to perform OCR on.
+        jobs (int): The number of CPUs ocrmypdf may use.
+
+    Returns:
+        tuple: The filename and the running ocrmypdf process, or None if it was not started.
     """
-    if not pages_to_ocr:
-        print(f"No pages to OCR for {input_file}. Skipping OCR step.")
-        return
-        
     # Get the base filename to create the output path
     filename = os.path.basename(input_file)
     output_file = os.path.join(output_folder, filename)
 
-    pages_arg = ",".join(map(str, pages_to_ocr))
+    pages_arg = to_ranges(pages_to_ocr)
 
     command = [
         'ocrmypdf',
         '-l', 'ell+eng+tur',  # Specify languages
         '--redo-ocr',         # Force OCR on the selected pages
         '--pages', pages_arg,
-        input_file,
-        output_file
+        '--jobs', str(jobs),
     ]
+    if FAST_OUTPUT:
+        command += ['--output-type', 'pdf', '--optimize', '0']
+    command += [input_file, output_file]
 
     print(f"Running command for {filename} on pages: {pages_arg}")
     try:
-        subprocess.run(command, check=True)
-        print(f"OCR completed successfully for {filename}.")
-    except subprocess.CalledProcessError as e:
-        print(f"ocrmypdf failed for {filename} with error: {e}")
+        return filename, subprocess.Popen(command)
     except FileNotFoundError:
         print("ocrmypdf command not found. Please ensure it's installed and in your PATH.")
+        return None
+
+def wait_for_ocr(running_ocr):
+    """
+    Waits for a background ocrmypdf run to finish and reports the result.
+
+    Args:
+        running_ocr (tuple): The filename and process returned by start_ocr_for_file, or None.
+    """
+    if running_ocr is None:
+        return
+    filename, process = running_ocr
+    returncode = process.wait()
+    if returncode == 0:
+        print(f"OCR completed successfully for {filename}.")
+    else:
+        print(f"ocrmypdf failed for {filename} with exit code {returncode}.")
+    print("-" * 30)
+
+def enqueue_ocr(ocr_queue, input_file, pages_to_ocr):
+    """
+    Queues a file for OCR. Files with nothing to OCR are reported and skipped right away.
+
+    Args:
+        ocr_queue (deque): The (input file, pages to OCR) entries waiting for ocrmypdf.
+        input_file (str): The path to the input PDF file.
+        pages_to_ocr (list): A list of page numbers to perform OCR on, or None if the file could not be analyzed.
+    """
+    if pages_to_ocr is None:
+        print(f"Could not analyze {input_file}. Skipping OCR step.")
+    elif not pages_to_ocr:
+        print(f"No pages to OCR for {input_file}. Skipping OCR step.")
+    else:
+        ocr_queue.append((input_file, pages_to_ocr))
+
+def advance_ocr(running_ocr, ocr_queue, output_folder, block=False, jobs=CPU_COUNT):
+    """
+    Reports a finished ocrmypdf run and starts the next queued file, one run at a time.
+    Without block, this never waits, so it can be called between analysis results;
+    with block, it runs the whole queue to completion.
+
+    Args:
+        running_ocr (tuple): The run returned by start_ocr_for_file, or None.
+        ocr_queue (deque): The (input file, pages to OCR) entries waiting for ocrmypdf.
+        output_folder (str): The folder to save the OCR'd files.
+        block (bool): Whether to wait for the queue to be drained.
+        jobs (int): The number of CPUs each ocrmypdf run started now may use.
+
+    Returns:
+        tuple: The run now in progress, or None if nothing is running.
+    """
+    while True:
+        if running_ocr is not None:
+            if not block and running_ocr[1].poll() is None:
+                return running_ocr
+            wait_for_ocr(running_ocr)
+            running_ocr = None
+        if not ocr_queue:
+            return None
+        input_file, pages_to_ocr = ocr_queue.popleft()
+        running_ocr = start_ocr_for_file(input_file, output_folder, pages_to_ocr, jobs)
+
+def map_file(file_path):
+    """
+    Memory-maps a file read-only.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        mmap.mmap: The mapped file. It stays valid after the file descriptor is closed.
+    """
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def prefetch_file(file_path):
+    """
+    Asks the kernel to start reading a file into the page cache in the background,
+    so the read overlaps with work on the current file. A no-op where posix_fadvise
+    is unavailable.
+
+    Args:
+        file_path (str): The path to the file.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+def fingerprint_file(file_path):
+    """
+    Computes a BLAKE2 hash of a file's contents.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hex digest of the file contents.
+    """
+    digest = hashlib.blake2b()
+    if os.path.getsize(file_path) == 0:
+        # Empty files cannot be mapped
+        return digest.hexdigest()
+    with map_file(file_path) as file_map, memoryview(file_map) as view:
+        for start in range(0, len(view), HASH_CHUNK_SIZE):
+            digest.update(view[start:start + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+def cache_settings():
+    """
+    Returns the settings a cached analysis depends on. They are stored in the cache
+    file's first line, and the cache is discarded when they change.
+
+    Returns:
+        dict: The heuristics version, the OCR threshold and the text extraction backend.
+    """
+    return {
+        "version": ANALYSIS_VERSION,
+        "threshold": THRESHOLD,
+        "backend": "pypdfium2" if pdfium is not None else "pypdf",
+    }
+
+def load_analysis_cache(cache_path):
+    """
+    Loads previous analysis results. The cache is a JSON lines file: a settings header,
+    then one result per line. If the file is missing, unreadable or was written with
+    other settings, a new one is started.
+
+    Args:
+        cache_path (str): The path to the cache file.
+
+    Returns:
+        dict: A mapping of file hash to the list of pages that need OCR.
+    """
+    try:
+        with open(cache_path) as f:
+            header = f.readline()
+            if json.loads(header) == cache_settings():
+                cache = {}
+                line = header
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by an interrupted run
+                    cache[entry["hash"]] = entry["pages"]
+                if not line.endswith("\n"):
+                    # Terminate a cut short last line so new results start on their own line
+                    with open(cache_path, 'a') as f_append:
+                        f_append.write("\n")
+                return cache
+            print(f"Analysis settings changed since '{cache_path}' was written, discarding it.")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable analysis cache '{cache_path}': {e}")
+
+    with open(cache_path, 'w') as f:
+        f.write(json.dumps(cache_settings()) + "\n")
+    return {}
+
+def append_analysis_cache(cache_path, file_hash, pages_to_ocr):
+    """
+    Records one analysis result. Results are appended as soon as they are known,
+    so an interrupted run keeps everything analyzed so far.
+
+    Args:
+        cache_path (str): The path to the cache file.
+        file_hash (str): The content hash of the analyzed file.
+        pages_to_ocr (list): The pages that need OCR.
+    """
+    with open(cache_path, 'a') as f:
+        f.write(json.dumps({"hash": file_hash, "pages": pages_to_ocr}) + "\n")
+
+def split_pages(num_pages, num_chunks):
+    """
+    Splits a document's pages into contiguous ranges of at least MIN_CHUNK_PAGES pages.
+
+    Args:
+        num_pages (int): The number of pages in the document.
+        num_chunks (int): The maximum number of ranges to produce.
+
+    Returns:
+        list: A list of (start, end) 0-based page ranges.
+    """
+    chunk_size = max(MIN_CHUNK_PAGES, -(-num_pages // num_chunks))
+    return [(start, min(start + chunk_size, num_pages)) for start in range(0, num_pages, chunk_size)]
+
+def scan_file(job):
+    """
+    Worker function to open a single PDF file, split it into page ranges and analyze the first one.
+    The file is parsed once here; only the remaining ranges of long files are parsed again.
+    This function is executed by each parallel process.
+
+    Args:
+        job (tuple): The path to the PDF file and the maximum number of page ranges.
+
+    Returns:
+        tuple: The file path, its page count (None if the file could not be read), the
+            analysis of the first range as returned by analyze_chunk, and the remaining ranges.
+    """
+    file_path, num_chunks = job
+    try:
+        with open_pdf(file_path) as (num_pages, page_chars):
+            ranges = split_pages(num_pages, num_chunks) or [(0, 0)]
+            start, end = ranges[0]
+            pages_needing_ocr, char_counts = analyze_page_range(page_chars(start, end), end - start)
+            return file_path, num_pages, (start, end, pages_needing_ocr, char_counts), ranges[1:]
+    except Exception as e:
+        print(f"An error occurred while reading '{file_path}': {e}")
+        return file_path, None, None, []
+
+def analyze_chunk(job):
+    """
+    Worker function to analyze a range of pages of a single PDF file.
+    This function is executed by each parallel process, each opening the PDF once.
+
+    Args:
+        job (tuple): The path to the PDF file and the 0-based (start, end) page range.
+
+    Returns:
+        tuple: The file path, the range start and end, the list of page numbers that likely
+            need OCR (None if the file could not be read) and the per-page character counts.
+    """
+    file_path, start, end = job
+    try:
+        with open_pdf(file_path) as (_, page_chars):
+            pages_needing_ocr, char_counts = analyze_page_range(page_chars(start, end), end - start)
+        return file_path, start, end, pages_needing_ocr, char_counts
+    except Exception as e:
+        print(f"An error occurred while analyzing pages {start + 1}-{end} of '{file_path}': {e}")
+        return file_path, start, end, None, None
+
+def finish_analysis(ocr_queue, file_path, file_chunks, cache_path, hashes):
+    """
+    Merges the analyzed page ranges of a file, reports and caches the result, and queues its OCR.
+
+    Args:
+        ocr_queue (deque): The (input file, pages to OCR) entries waiting for ocrmypdf.
+        file_path (str): The path to the PDF file.
+        file_chunks (dict): Range start -> (pages needing OCR, character counts) results.
+        cache_path (str): The path to the analysis cache to record the result in.
+        hashes (dict): The content hash of each file.
+    """
+    ordered = [file_chunks[start] for start in sorted(file_chunks)]
+    if any(pages_to_ocr is None for pages_to_ocr, _ in ordered):
+        enqueue_ocr(ocr_queue, file_path, None)
+        return
+
+    pages_to_ocr = [page for pages, _ in ordered for page in pages]
+    print(f"Analysis of '{file_path}':")
+    report_analysis(pages_to_ocr, [c for _, counts in ordered for c in counts] if VERBOSE else None)
+    append_analysis_cache(cache_path, hashes[file_path], pages_to_ocr)
+    enqueue_ocr(ocr_queue, file_path, pages_to_ocr)
 
 def process_folder(source_folder, output_folder):
     """
@@ -110,7 +621,8 @@ def process_folder(source_folder, output_folder):
         print(f"Created output folder: '{output_folder}'")
 
     # List all PDF files in the source folder
-    file_list = [f for f in os.listdir(source_folder) if f.endswith('.pdf')]
+    with os.scandir(source_folder) as entries:
+        file_list = [entry.name for entry in entries if entry.is_file() and entry.name.endswith('.pdf')]
     
     if not file_list:
         print(f"No PDF files found in '{source_folder}'.")
@@ -119,19 +631,113 @@ def process_folder(source_folder, output_folder):
     print(f"Found {len(file_list)} PDF files to process.")
     print("-" * 30)
 
-    for filename in file_list:
-        # if not filename.lower().endswith('tome 2.pdf'):
-        #     continue
-
-        file_path = os.path.join(source_folder, filename)
-        
-        # 1. Open and analyze the file
-        pages_to_ocr = analyze_pdf_pages(file_path)
-        
-        # 2. Run ocrmypdf if necessary
-        run_ocr_for_file(file_path, output_folder, pages_to_ocr)
-        
-        print("-" * 30)
+    file_paths = [os.path.join(source_folder, filename) for filename in file_list]
+
+    # 1. Reuse the analysis of files that have not changed since the last run
+    cache_path = os.path.join(output_folder, CACHE_FILENAME)
+    cache = load_analysis_cache(cache_path)
+    hashes = {}
+    for i, file_path in enumerate(file_paths):
+        if i + 1 < len(file_paths):
+            prefetch_file(file_paths[i + 1])
+        hashes[file_path] = fingerprint_file(file_path)
+
+    # 2. OCR a file as soon as its analysis is known. ocrmypdf already parallelizes
+    # internally, so files are OCR'd one at a time, but each run proceeds in the
+    # background while the pool keeps analyzing the next files.
+    ocr_queue = deque()
+    to_analyze = []
+    for file_path in file_paths:
+        if hashes[file_path] in cache:
+            print(f"Using cached analysis for '{file_path}'.")
+            enqueue_ocr(ocr_queue, file_path, cache[hashes[file_path]])
+        else:
+            to_analyze.append(file_path)
+    # Leave CPUs for the analysis pool only if one is about to start
+    running_ocr = advance_ocr(None, ocr_queue, output_folder, jobs=OCR_JOBS if to_analyze else CPU_COUNT)
+
+    # 3. Open and analyze the remaining files in parallel (text extraction is CPU-bound).
+    # Large files are split into page ranges so a single long PDF uses every core too.
+    if to_analyze:
+        with multiprocessing.Pool(processes=ANALYSIS_WORKERS) as pool:
+            # Results arrive through a queue, so finished ocrmypdf runs can be replaced
+            # while waiting, and range jobs are submitted as soon as their file is scanned
+            results = queue.Queue()
+            chunks = {}
+            remaining = {}
+            pending = 0
+
+            def submit(worker, job, kind, failed_result):
+                # The workers report their own errors; failed_result only covers
+                # failures outside them, such as a job that cannot be pickled
+                def on_error(e):
+                    print(f"An error occurred while analyzing '{job[0]}': {e}")
+                    results.put((kind, failed_result))
+
+                pool.apply_async(
+                    worker, (job,),
+                    callback=lambda result: results.put((kind, result)),
+                    error_callback=on_error,
+                )
+
+            # Every file is opened once, and short files are fully analyzed in the same pass
+            for file_path in to_analyze:
+                submit(scan_file, (file_path, ANALYSIS_WORKERS), "scan", (file_path, None, None, []))
+                pending += 1
+
+            # Each finished scan frees a worker for the next file, so keep the file after
+            # those being read on its way into the page cache
+            upcoming = iter(to_analyze[ANALYSIS_WORKERS:])
+
+            def prefetch_next():
+                file_path = next(upcoming, None)
+                if file_path is not None:
+                    prefetch_file(file_path)
+
+            prefetch_next()
+
+            with tqdm(total=0, desc="Checking pages", unit="page", mininterval=0.5, smoothing=0) as progress:
+                while pending:
+                    try:
+                        kind, result = results.get(timeout=OCR_POLL_INTERVAL)
+                    except queue.Empty:
+                        running_ocr = advance_ocr(running_ocr, ocr_queue, output_folder, jobs=OCR_JOBS)
+                        continue
+                    pending -= 1
+
+                    if kind == "scan":
+                        prefetch_next()
+                        file_path, num_pages, first, ranges = result
+                        if num_pages is None:
+                            enqueue_ocr(ocr_queue, file_path, None)
+                            running_ocr = advance_ocr(running_ocr, ocr_queue, output_folder, jobs=OCR_JOBS)
+                            continue
+                        start, end, pages_to_ocr, char_counts = first
+                        progress.total += num_pages
+                        progress.update(end - start)
+                        chunks[file_path] = {start: (pages_to_ocr, char_counts)}
+                        remaining[file_path] = len(ranges)
+                        if ranges:
+                            print(f"Analyzing '{file_path}' ({num_pages} pages) in {len(ranges) + 1} page ranges...")
+                            # Then the remaining page ranges of long files
+                            for start, end in ranges:
+                                submit(
+                                    analyze_chunk, (file_path, start, end), "chunk",
+                                    (file_path, start, end, None, None),
+                                )
+                                pending += 1
+                    else:
+                        file_path, start, end, pages_to_ocr, char_counts = result
+                        chunks[file_path][start] = (pages_to_ocr, char_counts)
+                        progress.update(end - start)
+                        remaining[file_path] -= 1
+
+                    if not remaining[file_path]:
+                        del remaining[file_path]
+                        finish_analysis(ocr_queue, file_path, chunks.pop(file_path), cache_path, hashes)
+                    running_ocr = advance_ocr(running_ocr, ocr_queue, output_folder, jobs=OCR_JOBS)
+
+    advance_ocr(running_ocr, ocr_queue, output_folder, block=True)
 
 
 if __name__ == "__main__":
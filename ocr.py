@@ -1,7 +1,8 @@
 import os
-import subprocess
-import multiprocessing
-from functools import partial
+import math
+import asyncio
+import tempfile
+import pypdf
 
 # --- Configuration ---
 # Set the directory to scan for PDF files. Use "." for the current directory.
@@ -14,71 +15,268 @@ LANGUAGES = "eng+ell+tur"
 # Suffix to add to the processed files. Input: "Tome 1.pdf" -> Output: "Tome 1_ocr.pdf"
 OUTPUT_SUFFIX = "_ocr"
 
+# Parallelism. Keep (concurrent ocrmypdf runs) x (ocrmypdf --jobs) close to the CPU count
+# so the workers don't oversubscribe the machine.
+CPU_COUNT = os.cpu_count() or 4
+POOL_SIZE = max(1, int(math.sqrt(CPU_COUNT)))
+JOBS_PER_FILE = max(1, CPU_COUNT // POOL_SIZE)
+
+# Set to True to skip PDF/A conversion and optimization and write plain PDF.
+# Ghostscript post-processing is single-threaded and dominates the run time on
+# multi-core machines.
+FAST_OUTPUT = False
+
+# How much of the ocrmypdf log to include in the error report of a failed file
+LOG_TAIL_BYTES = 4096
+
+# Short PDFs are merged and OCR'd by a single ocrmypdf run, so its startup cost
+# is paid once per batch instead of once per file. Only used with FAST_OUTPUT.
+BATCH_MAX_FILE_PAGES = 5   # Files with at most this many pages are batched
+BATCH_MAX_PAGES = 50       # Maximum number of pages in a batch
+
 # --- End of Configuration ---
 
-def run_ocr_on_file(input_file, source_dir, output_dir, languages, suffix):
+def read_log_tail(log_path, num_bytes):
     """
-    Worker function to run OCR on a single PDF file.
-    This function is executed by each parallel process.
+    Reads the last bytes of a log file without loading the whole file.
     """
-    # Construct the full path for the output file
-    filename_without_ext = os.path.splitext(input_file)[0]
-    output_file = f"{filename_without_ext}{suffix}.pdf"
+    with open(log_path, "rb") as log_file:
+        log_file.seek(0, os.SEEK_END)
+        log_file.seek(max(0, log_file.tell() - num_bytes))
+        return log_file.read().decode(errors="replace")
 
-    input_path = os.path.join(source_dir, input_file)
-    output_path = os.path.join(output_dir, output_file)
-
-    # Get the process ID for logging purposes
-    pid = os.getpid()
-
-    print(f"[Process {pid}] STARTING: OCR for '{input_file}'")
+def output_name(input_file, suffix):
+    """
+    Returns the output filename for an input file, e.g. "Tome 1.pdf" -> "Tome 1_ocr.pdf".
+    """
+    filename_without_ext = os.path.splitext(input_file)[0]
+    return f"{filename_without_ext}{suffix}.pdf"
 
+async def run_ocrmypdf(label, input_path, output_path, languages, jobs, fast_output):
+    """
+    Runs ocrmypdf on a single PDF file, streaming its output to a log file.
+    Returns None on success, or an error message.
+    """
     # Build the ocrmypdf command as a list of arguments
     command = [
         "ocrmypdf",
         "-l", languages,
         "--force-ocr",
-        input_path,
-        output_path,
+        "--jobs", str(jobs),
     ]
+    if fast_output:
+        command += ["--output-type", "pdf", "--optimize", "0"]
+    command += [input_path, output_path]
+
+    # ocrmypdf's output is streamed to a log file so it is never held in memory
+    log_path = f"{output_path}.log"
 
     try:
         # Execute the command
-        result = subprocess.run(
-            command,
-            check=True,       # Raise an exception if the command returns a non-zero exit code
-            capture_output=True,
-            text=True         # Capture stdout/stderr as text
-        )
-        print(f"[Process {pid}] SUCCESS: Created '{output_file}'")
-        return None # Return None on success
+        with open(log_path, "wb") as log_file:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=log_file
+            )
+            returncode = await process.wait()
     except FileNotFoundError:
         # This error occurs if `ocrmypdf` is not installed or not in the system's PATH
-        return f"[Process {pid}] FATAL ERROR: The 'ocrmypdf' command was not found. Please ensure it is installed and accessible in your system's PATH."
-    except subprocess.CalledProcessError as e:
+        if os.path.exists(log_path):
+            os.remove(log_path)
+        return "FATAL ERROR: The 'ocrmypdf' command was not found. Please ensure it is installed and accessible in your system's PATH."
+
+    if returncode != 0:
         # This error occurs if ocrmypdf returns an error
         error_message = f"""
-        [Process {pid}] FAILED to process '{input_file}'.
-        ocrmypdf returned an error (exit code {e.returncode}).
-        --- OCRmyPDF Error Output ---
-        {e.stderr.strip()}
+        FAILED to process {label}.
+        ocrmypdf returned an error (exit code {returncode}). Full log: '{log_path}'
+        --- OCRmyPDF Error Output (last {LOG_TAIL_BYTES} bytes) ---
+        {read_log_tail(log_path, LOG_TAIL_BYTES).strip()}
         -----------------------------
         """
         return error_message
 
+    os.remove(log_path)
+    return None # Return None on success
+
+async def run_ocr_on_file(input_file, source_dir, output_dir, languages, suffix, jobs=1, fast_output=False):
+    """
+    Runs OCR on a single PDF file.
+    """
+    # Construct the full path for the output file
+    output_file = output_name(input_file, suffix)
+
+    input_path = os.path.join(source_dir, input_file)
+    output_path = os.path.join(output_dir, output_file)
+
+    print(f"STARTING: OCR for '{input_file}'")
+
+    error = await run_ocrmypdf(f"'{input_file}'", input_path, output_path, languages, jobs, fast_output)
+    if error is None:
+        print(f"SUCCESS: Created '{output_file}'")
+    return error
+
+def merge_batch(input_files, source_dir, batch_path):
+    """
+    Merges PDF files into one, returning the index of each file's first page
+    followed by the total page count, and each file's document info.
+    """
+    offsets = []
+    infos = []
+    writer = pypdf.PdfWriter()
+    for input_file in input_files:
+        reader = pypdf.PdfReader(os.path.join(source_dir, input_file))
+        offsets.append(len(writer.pages))
+        # The merged file has no document info of its own, so keep each file's to restore on split
+        info = reader.metadata or {}
+        infos.append({key: info[key] for key in info})
+        writer.append(reader)
+    offsets.append(len(writer.pages))
+    writer.write(batch_path)
+    return offsets, infos
+
+def split_batch(batch_path, input_files, offsets, infos, output_dir, suffix):
+    """
+    Splits a merged PDF back into one output file per input, using the offsets from merge_batch.
+    Each output gets its input's document info, updated with the entries ocrmypdf
+    wrote (such as the producer), and the XMP metadata written by ocrmypdf.
+    """
+    reader = pypdf.PdfReader(batch_path)
+    xmp = reader.root_object.get("/Metadata")
+    xmp_data = xmp.get_object().get_data() if xmp is not None else None
+    for input_file, info, start, end in zip(input_files, infos, offsets, offsets[1:]):
+        file_writer = pypdf.PdfWriter()
+        for page in reader.pages[start:end]:
+            file_writer.add_page(page)
+        if info:
+            file_writer.add_metadata(info)
+        if reader.metadata:
+            file_writer.add_metadata(reader.metadata)
+        if xmp_data is not None:
+            file_writer.xmp_metadata = xmp_data
+        file_writer.write(os.path.join(output_dir, output_name(input_file, suffix)))
+
+async def run_ocr_on_batch(input_files, source_dir, output_dir, languages, suffix, jobs=1, fast_output=False):
+    """
+    Runs OCR on a group of PDF files.
+    Several files are merged, OCR'd by a single ocrmypdf run and split back into
+    one output per input. A group of one file is OCR'd directly.
+    """
+    if len(input_files) == 1:
+        return await run_ocr_on_file(input_files[0], source_dir, output_dir, languages, suffix, jobs, fast_output)
+
+    async def run_one_by_one():
+        errors = [
+            await run_ocr_on_file(f, source_dir, output_dir, languages, suffix, jobs, fast_output)
+            for f in input_files
+        ]
+        return "\n".join(error for error in errors if error) or None
+
+    print(f"STARTING: OCR for a batch of {len(input_files)} files: {', '.join(input_files)}")
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as batch_dir:
+        batch_input = os.path.join(batch_dir, "batch.pdf")
+        batch_output = os.path.join(batch_dir, "batch_ocr.pdf")
+
+        # Merging and splitting is pypdf work, so keep it off the event loop
+        try:
+            offsets, infos = await asyncio.to_thread(merge_batch, input_files, source_dir, batch_input)
+        except Exception as e:
+            print(f"Could not merge the batch ({e}), processing its files one by one")
+            return await run_one_by_one()
+
+        label = f"the batch of {', '.join(repr(f) for f in input_files)}"
+        error = await run_ocrmypdf(label, batch_input, batch_output, languages, jobs, fast_output)
+        if error is not None:
+            # Keep the batch log, which would otherwise be removed with the batch directory
+            log_path = os.path.join(output_dir, f"{output_name(input_files[0], suffix)}.batch.log")
+            if os.path.exists(f"{batch_output}.log"):
+                os.replace(f"{batch_output}.log", log_path)
+            print(f"OCR failed for {label} (log: '{log_path}'), processing its files one by one")
+            return await run_one_by_one()
+
+        await asyncio.to_thread(split_batch, batch_output, input_files, offsets, infos, output_dir, suffix)
+
+    print(f"SUCCESS: Created {', '.join(repr(output_name(f, suffix)) for f in input_files)}")
+    return None
+
+async def run_all(groups, limit, **options):
+    """
+    Runs OCR on every group of files, with at most `limit` ocrmypdf processes at a time.
+    A single Python process supervises all of them.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run_group(group):
+        async with semaphore:
+            try:
+                return await run_ocr_on_batch(group, **options)
+            except Exception as e:
+                # Report the group as failed instead of aborting the other runs
+                return f"FAILED to process {', '.join(repr(f) for f in group)}: {e}"
+
+    return await asyncio.gather(*(run_group(group) for group in groups))
+
+def find_outputs(output_dir):
+    """
+    Returns the modification time of each file in the output directory, by name.
+    """
+    try:
+        with os.scandir(output_dir) as entries:
+            return {entry.name: entry.stat().st_mtime for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+def plan_batches(input_files, source_dir):
+    """
+    Groups short PDF files into batches of at most BATCH_MAX_PAGES pages.
+    Longer files, and files whose page count cannot be read, get a group of their own.
+    """
+    groups = []
+    batch = []
+    batch_pages = 0
+    for input_file in input_files:
+        try:
+            num_pages = len(pypdf.PdfReader(os.path.join(source_dir, input_file)).pages)
+        except Exception:
+            # Let ocrmypdf report the problem for this file on its own
+            num_pages = None
+        if num_pages is None or num_pages > BATCH_MAX_FILE_PAGES:
+            groups.append([input_file])
+            continue
+        if batch and batch_pages + num_pages > BATCH_MAX_PAGES:
+            groups.append(batch)
+            batch, batch_pages = [], 0
+        batch.append(input_file)
+        batch_pages += num_pages
+    if batch:
+        groups.append(batch)
+    return groups
 
 def main():
     # Find all PDF files in the source directory that have not been processed yet
     try:
-        all_files = os.listdir(SOURCE_DIRECTORY)
+        with os.scandir(SOURCE_DIRECTORY) as entries:
+            source_files = {
+                entry.name: entry.stat().st_mtime for entry in entries
+                if entry.is_file()
+                and entry.name.lower().endswith(".pdf")
+                and not entry.name.lower().endswith(f"{OUTPUT_SUFFIX}.pdf")
+            }
     except FileNotFoundError:
         print(f"Error: The directory '{SOURCE_DIRECTORY}' was not found.")
         return
 
+    # Skip files whose output already exists and is newer than the input, so an
+    # interrupted run can be resumed
+    done = find_outputs(OUTPUT_DIRECTORY)
     files_to_process = [
-        f for f in all_files
-        if f.lower().endswith(".pdf") and not f.lower().endswith(f"{OUTPUT_SUFFIX}.pdf")
+        f for f, mtime in source_files.items()
+        if done.get(output_name(f, OUTPUT_SUFFIX), -1) < mtime
     ]
+    if len(files_to_process) < len(source_files):
+        print(f"Skipping {len(source_files) - len(files_to_process)} file(s) that were already processed.")
 
     if not files_to_process:
         print("No new PDF files to process found.")
@@ -87,16 +285,38 @@ def main():
     print(f"Found {len(files_to_process)} PDF file(s) to process:")
     for f in files_to_process:
         print(f"  - {f}")
-        partial(
-        run_ocr_on_file,
+    print("-" * 40)
+
+    os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+
+    # Splitting a batch rewrites the PDF, which would break PDF/A conformance,
+    # so only batch files when writing plain PDF
+    if FAST_OUTPUT:
+        groups = plan_batches(files_to_process, SOURCE_DIRECTORY)
+    else:
+        groups = [[f] for f in files_to_process]
+
+    errors = asyncio.run(run_all(
+        groups,
+        POOL_SIZE,
         source_dir=SOURCE_DIRECTORY,
         output_dir=OUTPUT_DIRECTORY,
         languages=LANGUAGES,
-        suffix=OUTPUT_SUFFIX
-        )
+        suffix=OUTPUT_SUFFIX,
+        jobs=JOBS_PER_FILE,
+        fast_output=FAST_OUTPUT
+    ))
+
+    errors = [e for e in errors if e]
     print("-" * 40)
+    if errors:
+        print(f"Finished with {len(errors)} error(s):")
+        for error in errors:
+            print(error)
+    else:
+        print("All files processed successfully.")
 
 
 if __name__ == "__main__":
-    # This check is important for multiprocessing to work correctly on all platforms
+    # Only run when executed as a script, not when imported
     main()